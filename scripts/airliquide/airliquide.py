@@ -23,12 +23,21 @@ import sys
 import time
 import logging
 import shutil
-import glob
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 
 import fitz  # PyMuPDF
 import cv2
 import numpy as np
-from PIL import Image
+
+# Numba es opcional: sin él, el núcleo de detección se ejecuta en Python puro
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # ================================================================================
 # FIX ENCODING PARA WINDOWS
@@ -50,15 +59,27 @@ PROCESADOS_DIR_NAME = "procesados"
 LOG_DIR_NAME = "logs"
 
 # Parámetros de procesamiento
-DEFAULT_DPI = 150
+# La resolución solo se usa para localizar las líneas; el recorte final se hace
+# sobre coordenadas vectoriales del PDF y no depende de ella.
+DETECT_DPI = 100
 LINE_MIN_FRAC = 0.5
-KERNEL_FRAC = 0.02
 MARGIN_THRESH = 0.02
-PAD_PIXELS = 6
+PAD_PIXELS = 4
 MIN_LINE_POSITION = 0.25
 MAX_LINE_POSITION = 0.75
-REINTENTOS_ARCHIVO = 3
-ESPERA_ARCHIVO = 2
+PAGINAS_POR_BLOQUE = 50  # Páginas de salida en memoria antes de volcar a disco
+
+# Guardado del PDF final: comprimido y sin objetos duplicados o huérfanos
+OPCIONES_GUARDADO_PDF = {
+    'deflate': True,
+    'deflate_images': True,
+    'deflate_fonts': True,
+    'garbage': 4,
+    'clean': True
+}
+REINTENTOS_ARCHIVO = 6
+ESPERA_INICIAL_ARCHIVO = 0.2  # Segundos; se duplica en cada reintento
+ESPERA_ARCHIVO = 1            # Espera máxima entre reintentos
 
 # Configuración por cliente
 CLIENTE_CONFIG = {
@@ -78,16 +99,29 @@ CLIENTE_CONFIG = {
 # CONFIGURACIÓN DE LOGGING
 # ================================================================================
 
-def setup_logging(cliente):
+# Configuración de logging activa en este proceso: (cliente, por_proceso)
+_logging_configurado = None
+
+
+def setup_logging(cliente, por_proceso=False):
     """
-    Configura el sistema de logging para un cliente específico.
+    Configura el sistema de logging para un cliente específico. Si ya está
+    configurado para ese cliente, no hace nada.
     
     Args:
         cliente: Nombre del cliente (Galicia o Bilbao)
+        por_proceso: Si es True, usa un archivo de log propio del proceso (PID)
+            para no mezclar líneas de procesos en paralelo
     """
+    global _logging_configurado
+    if _logging_configurado == (cliente, por_proceso):
+        return
+    _logging_configurado = (cliente, por_proceso)
+    
     log_dir = os.path.join(BASE_WORK_DIR, LOG_DIR_NAME, cliente)
     os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(log_dir, f"cortar_{cliente.lower()}.log")
+    sufijo = f"_{os.getpid()}" if por_proceso else ""
+    log_file = os.path.join(log_dir, f"cortar_{cliente.lower()}{sufijo}.log")
     
     # Configurar con encoding UTF-8
     for handler in logging.root.handlers[:]:
@@ -111,118 +145,375 @@ def setup_logging(cliente):
 
 def esperar_archivo(pdf_path, reintentos=REINTENTOS_ARCHIVO, espera=ESPERA_ARCHIVO):
     """
-    Espera a que un archivo esté disponible y accesible.
+    Espera a que un archivo esté disponible y su tamaño sea estable (copia
+    terminada). Comprueba con os.stat y espera con backoff exponencial.
     
     Args:
         pdf_path: Ruta del archivo PDF
         reintentos: Número de intentos de acceso
-        espera: Segundos entre intentos
+        espera: Segundos máximos entre intentos
         
     Returns:
         bool: True si el archivo es accesible, False en caso contrario
     """
     logging.info(f"Verificando acceso al archivo: {os.path.basename(pdf_path)}")
     
+    tamano_anterior = -1
+    
     for intento in range(1, reintentos + 1):
-        if os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 0:
-            try:
-                with open(pdf_path, "rb") as f:
-                    logging.info(f"OK: Archivo accesible (intento {intento}/{reintentos})")
-                    return True
-            except (PermissionError, OSError) as e:
-                logging.warning(f"Intento {intento}/{reintentos}: Archivo bloqueado - {e}")
-        else:
+        try:
+            tamano = os.stat(pdf_path).st_size
+        except OSError:
+            tamano = 0
+        
+        if tamano > 0 and tamano == tamano_anterior:
+            logging.info(f"OK: Archivo accesible (intento {intento}/{reintentos})")
+            return True
+        
+        if tamano == 0:
             logging.warning(f"Intento {intento}/{reintentos}: Archivo no existe o esta vacio")
+        elif tamano_anterior > 0:
+            logging.warning(f"Intento {intento}/{reintentos}: Archivo en copia ({tamano} bytes)")
+        
+        tamano_anterior = tamano
         
         if intento < reintentos:
-            time.sleep(espera)
+            time.sleep(min(ESPERA_INICIAL_ARCHIVO * 2 ** (intento - 1), espera))
     
     logging.error(f"ERROR: Archivo no accesible tras {reintentos} intentos")
     return False
 
 
-def render_page_to_image(page, dpi=DEFAULT_DPI):
+def render_page_to_image(page, dpi=DETECT_DPI):
     """
-    Renderiza una página PDF como imagen.
+    Renderiza una página PDF como imagen en escala de grises.
     
     Args:
         page: Página de PyMuPDF
         dpi: Resolución de renderizado
         
     Returns:
-        tuple: (imagen PIL, pixmap, zoom)
+        tuple: (array NumPy en grises, pixmap, zoom)
+        
+    Nota:
+        El array es una vista sin copia sobre el buffer del pixmap; el pixmap
+        debe mantenerse referenciado mientras se use el array.
     """
     zoom = dpi / 72.0
-    mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat, alpha=False)
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    return img, pix, zoom
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False, colorspace=fitz.csGRAY)
+    img_gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width)
+    return img_gray, pix, zoom
+
+
+@njit(cache=True, nogil=True)
+def _scan_lines(row_counts, row_cum, w, min_line_len, max_line_height, y_lo, y_hi, band_size):
+    """
+    Recorre la proyección horizontal buscando tramos de filas que formen una
+    línea separadora válida (grosor, posición y márgenes limpios).
+    
+    Args:
+        row_counts: Píxeles oscuros por fila
+        row_cum: Suma acumulada de row_counts (longitud h + 1)
+        w: Ancho de la imagen en píxeles
+        min_line_len: Píxeles oscuros mínimos por fila para considerar línea
+        max_line_height: Grosor máximo de línea en píxeles
+        y_lo: Posición Y mínima del centro de la línea
+        y_hi: Posición Y máxima del centro de la línea
+        band_size: Altura de las bandas de margen en píxeles
+        
+    Returns:
+        ndarray: Array (N, 2) con (y inicial, grosor) de cada línea candidata
+    """
+    h = row_counts.shape[0]
+    out = np.empty((h, 2), dtype=np.int64)
+    n = 0
+    y = 0
+    
+    while y < h:
+        if row_counts[y] < min_line_len:
+            y += 1
+            continue
+        
+        start = y
+        while y < h and row_counts[y] >= min_line_len:
+            y += 1
+        hh = y - start
+        line_y = start + hh // 2
+        
+        # Validar grosor y posición en la página
+        if hh > max_line_height or line_y < y_lo or line_y > y_hi:
+            continue
+        
+        # Validar márgenes
+        y_top = max(0, start - band_size)
+        y_bot = min(h, y + band_size)
+        top_density = (row_cum[start] - row_cum[y_top]) / ((start - y_top) * w + 1)
+        bot_density = (row_cum[y_bot] - row_cum[y]) / ((y_bot - y) * w + 1)
+        
+        if top_density < 0.02 and bot_density < 0.02:
+            out[n, 0] = start
+            out[n, 1] = hh
+            n += 1
+    
+    return out[:n]
 
 
-def detect_horizontal_lines_refinado(img_pil, line_min_frac=LINE_MIN_FRAC, 
-                                    kernel_frac=KERNEL_FRAC, margin_thresh=MARGIN_THRESH):
+def fusionar_lineas_cercanas(ys, distancia):
     """
-    Detecta líneas horizontales gruesas en una imagen.
+    Ordena las posiciones Y y fusiona las que están a menos de `distancia`
+    (una línea gruesa puede aparecer como dos tramos contiguos).
     
     Args:
-        img_pil: Imagen PIL
+        ys: Posiciones Y de líneas
+        distancia: Separación máxima para considerar la misma línea
+        
+    Returns:
+        list: Posiciones Y ordenadas, una por línea
+    """
+    out = []
+    for y in sorted(ys):
+        if not out or y - out[-1] > distancia:
+            out.append(y)
+    return out
+
+
+DetectionParams = namedtuple(
+    "DetectionParams",
+    ["min_line_len", "max_line_height", "y_lo", "y_hi", "band_size"]
+)
+
+
+@lru_cache(maxsize=None)
+def build_detection_params(h, w, line_min_frac=LINE_MIN_FRAC, margin_thresh=MARGIN_THRESH):
+    """
+    Calcula los parámetros de detección en píxeles para un tamaño de imagen.
+    Se memorizan por tamaño, ya que las páginas de un PDF suelen coincidir.
+    
+    Args:
+        h: Altura de la imagen en píxeles
+        w: Ancho de la imagen en píxeles
         line_min_frac: Fracción mínima del ancho para considerar línea
-        kernel_frac: Fracción del ancho para el kernel morfológico
         margin_thresh: Umbral de margen para validar líneas
         
+    Returns:
+        DetectionParams: Parámetros enteros para detect_horizontal_lines_fast
+    """
+    return DetectionParams(
+        min_line_len=int(w * line_min_frac),
+        max_line_height=max(3, int(0.02 * h)),
+        y_lo=int(h * MIN_LINE_POSITION),
+        y_hi=int(h * MAX_LINE_POSITION),
+        band_size=int(h * margin_thresh)
+    )
+
+
+def detect_horizontal_lines_fast(img_gray, params):
+    """
+    Detecta líneas horizontales gruesas en una imagen mediante la proyección
+    horizontal de píxeles oscuros (recuento por filas).
+    
+    Args:
+        img_gray: Imagen en escala de grises (array NumPy)
+        params: DetectionParams calculados para el tamaño de la imagen
+        
     Returns:
         list: Lista de posiciones Y de líneas detectadas
     """
-    img_gray = np.array(img_pil.convert("L"))
     h, w = img_gray.shape
     
-    # Binarización
-    _, th = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Binarización (1 = píxel oscuro)
+    _, th = cv2.threshold(img_gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     
-    # Detección de líneas horizontales
-    kernel_w = max(1, int(w * kernel_frac))
-    horiz_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_w, 1))
-    horiz = cv2.morphologyEx(th, cv2.MORPH_OPEN, horiz_kernel)
+    # Proyección horizontal: píxeles oscuros por fila
+    row_counts = th.sum(axis=1, dtype=np.int64)
+    # Suma acumulada: píxeles oscuros de las filas [a, b) = row_cum[b] - row_cum[a]
+    row_cum = np.concatenate(([0], np.cumsum(row_counts)))
     
-    # Encontrar contornos
-    contours, _ = cv2.findContours(horiz, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    candidatas = _scan_lines(
+        row_counts, row_cum, w,
+        params.min_line_len, params.max_line_height,
+        params.y_lo, params.y_hi, params.band_size
+    )
     
     ys = []
-    min_line_len = int(w * line_min_frac)
-    max_line_height = max(3, int(0.02 * h))
     
-    for cnt in contours:
-        x, y, ww, hh = cv2.boundingRect(cnt)
+    for y, hh in candidatas:
+        y, hh = int(y), int(hh)
         
-        # Validar tamaño de línea
-        if ww < min_line_len or hh > max_line_height:
-            continue
+        # Validar que no haya texto cruzando; si las 5 filas por encima y por
+        # debajo del tramo están vacías no puede haberlo y se omite la proyección
+        fin = y + hh
+        if row_cum[y] - row_cum[max(0, y-5)] or row_cum[min(h, fin+5)] - row_cum[fin]:
+            roi = th[max(0, y-5):min(h, y+5), :]
+            if roi.sum(axis=0).max() > 0.5 * roi.shape[0]:
+                continue
         
-        line_y = y + hh // 2
+        ys.append(y + hh // 2)
+    
+    return fusionar_lineas_cercanas(ys, params.max_line_height)
+
+
+def luminancia(color):
+    """
+    Calcula la luminancia (0 = negro, 1 = blanco) de un color de PyMuPDF.
+    
+    Args:
+        color: Tupla de gris, RGB o CMYK, o None si no se pinta
         
-        # Validar posición en la página
-        if line_y < int(h * MIN_LINE_POSITION) or line_y > int(h * MAX_LINE_POSITION):
-            continue
+    Returns:
+        float: Luminancia del color; 1.0 si no hay color
+    """
+    if not color:
+        return 1.0
+    if len(color) == 1:
+        return color[0]
+    if len(color) == 3:
+        return 0.299 * color[0] + 0.587 * color[1] + 0.114 * color[2]
+    c, m, y, k = color
+    return (0.299 * (1 - c) + 0.587 * (1 - m) + 0.114 * (1 - y)) * (1 - k)
+
+
+def tramos_horizontales(drawing, min_grosor, max_grosor):
+    """
+    Extrae los tramos de línea horizontal oscura de un trazo vectorial.
+    
+    Args:
+        drawing: Trazo devuelto por page.get_drawings()
+        min_grosor: Grosor mínimo en puntos (1 píxel a la resolución de detección)
+        max_grosor: Grosor máximo en puntos
         
-        # Validar márgenes
-        band_size = int(h * margin_thresh)
-        y_top = max(0, y - band_size)
-        y_bot = min(h, y + hh + band_size)
-        top_density = np.sum(th[y_top:y, :]) / ((y - y_top) * w * 255 + 1)
-        bot_density = np.sum(th[y+hh:y_bot, :]) / ((y_bot - (y+hh)) * w * 255 + 1)
+    Returns:
+        list: Tuplas (y, x0, x1) en puntos PDF, o None si el trazo contiene
+            algo que no sea una línea horizontal oscura
+    """
+    tramos = []
+    
+    for item in drawing["items"]:
+        if item[0] == "l":
+            # Segmento de línea trazado
+            p1, p2 = item[1], item[2]
+            grosor = drawing.get("width") or 0
+            if (abs(p1.y - p2.y) >= 0.5 or luminancia(drawing.get("color")) >= 0.5
+                    or not min_grosor <= grosor <= max_grosor):
+                return None
+            tramos.append(((p1.y + p2.y) / 2, min(p1.x, p2.x), max(p1.x, p2.x)))
+        elif item[0] == "re":
+            # Rectángulo relleno usado como filete grueso
+            r = item[1]
+            if luminancia(drawing.get("fill")) >= 0.5 or not min_grosor <= r.height <= max_grosor:
+                return None
+            tramos.append(((r.y0 + r.y1) / 2, r.x0, r.x1))
+        else:
+            return None
+    
+    return tramos
+
+
+def longitud_cubierta(intervalos):
+    """
+    Calcula la longitud total cubierta por una lista de intervalos (x0, x1),
+    sin contar dos veces los solapes.
+    
+    Args:
+        intervalos: Lista de tuplas (x0, x1)
         
-        if not (top_density < 0.02 and bot_density < 0.02):
-            continue
+    Returns:
+        float: Longitud cubierta
+    """
+    total = 0.0
+    fin = float("-inf")
+    for x0, x1 in sorted(intervalos):
+        if x1 > fin:
+            total += x1 - max(x0, fin)
+            fin = x1
+    return total
+
+
+def detect_horizontal_lines_vectorial(page, line_min_frac=LINE_MIN_FRAC,
+                                     margin_thresh=MARGIN_THRESH, dpi=DETECT_DPI):
+    """
+    Detecta líneas horizontales a partir de los trazos vectoriales de la página,
+    sin rasterizar. Solo encuentra líneas en PDFs generados (no escaneados).
+    
+    Es conservadora: solo acepta la página si las bandas de margen de todas las
+    líneas candidatas están completamente vacías (sin texto, imágenes ni otros
+    trazos que puedan cruzarlas), caso en el que la detección sobre imagen daría
+    el mismo resultado. Si alguna candidata no cumple, devuelve una lista vacía
+    para que la página se rasterice.
+    
+    Args:
+        page: Página de PyMuPDF
+        line_min_frac: Fracción mínima del ancho para considerar línea
+        margin_thresh: Umbral de margen para validar líneas
+        dpi: Resolución de la detección sobre imagen (grosor mínimo visible)
         
-        # Validar que no haya texto cruzando
-        roi = th[max(0, y-5):min(h, y+5), x:x+ww]
-        vertical_proj = np.sum(roi, axis=0)
-        if np.any(vertical_proj > 0.5 * roi.shape[0] * 255):
-            continue
+    Returns:
+        list: Lista de posiciones Y de líneas detectadas, en puntos PDF
+    """
+    if page.rotation:
+        return []
+    
+    rect = page.rect
+    min_line_len = rect.width * line_min_frac
+    max_line_height = max(3, 0.02 * rect.height)
+    y_lo = rect.height * MIN_LINE_POSITION
+    y_hi = rect.height * MAX_LINE_POSITION
+    
+    drawings = [
+        (drawing, tramos_horizontales(drawing, 72.0 / dpi, max_line_height))
+        for drawing in page.get_drawings()
+    ]
+    
+    # Agrupar tramos a la misma altura: como en la proyección por filas, una
+    # línea discontinua o partida cuenta por la longitud total que cubre
+    tramos = sorted(
+        t for _, ts in drawings if ts for t in ts if y_lo <= t[0] <= y_hi
+    )
+    grupos = []
+    for y, x0, x1 in tramos:
+        if grupos and y - grupos[-1][0][-1] <= max_line_height:
+            grupos[-1][0].append(y)
+            grupos[-1][1].append((x0, x1))
+        else:
+            grupos.append(([y], [(x0, x1)]))
+    
+    candidatas = [
+        sum(ys_grupo) / len(ys_grupo)
+        for ys_grupo, intervalos in grupos
+        if longitud_cubierta(intervalos) >= min_line_len
+    ]
+    if not candidatas:
+        return []
+    
+    # Validar márgenes: bandas por encima y por debajo completamente vacías
+    band_size = rect.height * margin_thresh
+    words = page.get_text("words")
+    imagenes = [info["bbox"] for info in page.get_image_info()]
+    
+    for y in candidatas:
+        b0, b1 = y - band_size, y + band_size
         
-        ys.append(line_y)
-    
-    return sorted(set(ys))
+        if any(w[1] < b1 and w[3] > b0 for w in words):
+            return []
+        if any(bbox[1] < b1 and bbox[3] > b0 for bbox in imagenes):
+            return []
+        
+        for drawing, ts in drawings:
+            r = drawing["rect"]
+            if r.y0 >= b1 or r.y1 <= b0:
+                continue
+            # Rellenos casi blancos: invisibles tras la binarización
+            if drawing.get("color") is None and luminancia(drawing.get("fill")) >= 0.9:
+                continue
+            if ts is None:
+                return []
+            # Trazo solo de líneas horizontales (puede agrupar varias): dentro
+            # de la banda solo se admiten los tramos de la propia línea
+            margen = max_line_height / 2
+            if any(b0 - margen < t[0] < b1 + margen and abs(t[0] - y) > max_line_height for t in ts):
+                return []
+    
+    return candidatas
 
 
 def pixel_lines_to_pdf_rects(y_pixels, img_height_px, zoom, pad_px=PAD_PIXELS):
@@ -254,6 +545,92 @@ def pixel_lines_to_pdf_rects(y_pixels, img_height_px, zoom, pad_px=PAD_PIXELS):
     return rects
 
 
+def recortar_pagina(src_doc, out_doc, pno, y_pixels, img_height_px, zoom):
+    """
+    Añade al documento de salida los recortes de una página.
+    
+    Args:
+        src_doc: Documento fuente
+        out_doc: Documento destino
+        pno: Número de página
+        y_pixels: Lista de posiciones Y de líneas detectadas
+        img_height_px: Altura de la imagen en píxeles
+        zoom: Factor de zoom aplicado
+        
+    Returns:
+        int: Número de recortes creados (0 si se copia la página completa)
+    """
+    if not y_pixels:
+        # Sin líneas detectadas, copiar página completa
+        logging.info("  - Sin lineas detectadas, copiando pagina completa")
+        out_doc.insert_pdf(src_doc, from_page=pno, to_page=pno)
+        return 0
+    
+    # Líneas detectadas, recortar
+    logging.info(f"  - {len(y_pixels)} linea(s) detectada(s)")
+    page = src_doc[pno]
+    rects = pixel_lines_to_pdf_rects(y_pixels, img_height_px, zoom)
+    
+    # show_pdf_page reutiliza la página fuente como XObject en todos los recortes;
+    # clonar la página y ajustar el cropbox duplica sus recursos en cada recorte
+    for idx, (y0, y1) in enumerate(rects, 1):
+        rect = fitz.Rect(0, y0, page.rect.width, y1)
+        new_page = out_doc.new_page(width=rect.width, height=rect.height)
+        new_page.show_pdf_page(new_page.rect, src_doc, pno, clip=rect)
+        logging.info(f"  - Recorte #{idx} creado")
+    
+    return len(rects)
+
+
+def volcar_bloque(out_doc, bloques):
+    """
+    Guarda las páginas acumuladas en un PDF temporal para liberar memoria.
+    
+    Args:
+        out_doc: Documento de salida con las páginas del bloque
+        bloques: Lista de rutas de bloques temporales (se añade el nuevo)
+        
+    Returns:
+        fitz.Document: Documento vacío para seguir acumulando páginas
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix="airliquide_", suffix=".pdf")
+    os.close(fd)
+    bloques.append(tmp_path)
+    out_doc.save(tmp_path)
+    out_doc.close()
+    return fitz.open()
+
+
+def guardar_pdf_salida(out_doc, bloques, out_path):
+    """
+    Guarda el PDF final uniendo, en orden, los bloques temporales y las
+    páginas que quedan en memoria. La unión carga todas las páginas en
+    final_doc: los bloques acotan la memoria durante el recorte, no al guardar.
+    
+    Args:
+        out_doc: Documento de salida con las últimas páginas
+        bloques: Lista de rutas de bloques temporales
+        out_path: Ruta del PDF final
+    """
+    if not bloques:
+        out_doc.save(out_path, **OPCIONES_GUARDADO_PDF)
+        return
+    
+    final_doc = fitz.open()
+    try:
+        for tmp_path in bloques:
+            bloque = fitz.open(tmp_path)
+            final_doc.insert_pdf(bloque)
+            bloque.close()
+        # Si el total es múltiplo de PAGINAS_POR_BLOQUE no quedan páginas en
+        # memoria, y insert_pdf falla con un documento vacío
+        if out_doc.page_count:
+            final_doc.insert_pdf(out_doc)
+        final_doc.save(out_path, **OPCIONES_GUARDADO_PDF)
+    finally:
+        final_doc.close()
+
+
 def detectar_cliente_desde_ruta(pdf_path):
     """
     Detecta el cliente (Galicia o Bilbao) desde la ruta del archivo.
@@ -274,13 +651,15 @@ def detectar_cliente_desde_ruta(pdf_path):
 # FUNCIÓN PRINCIPAL DE PROCESAMIENTO
 # ================================================================================
 
-def cortar_pdf(pdf_path, dpi=DEFAULT_DPI):
+def cortar_pdf(pdf_path, dpi=DETECT_DPI, log_por_proceso=False, hilos=None):
     """
     Procesa un PDF de Air Liquide recortando por líneas horizontales.
     
     Args:
         pdf_path: Ruta del archivo PDF a procesar
         dpi: Resolución de renderizado
+        log_por_proceso: Si es True, registra en un log propio del proceso
+        hilos: Hilos de detección por página (por defecto, uno por CPU)
         
     Returns:
         bool: True si el procesamiento fue exitoso, False en caso contrario
@@ -291,7 +670,7 @@ def cortar_pdf(pdf_path, dpi=DEFAULT_DPI):
         print(f"[ERROR] No se puede determinar el cliente desde la ruta: {pdf_path}")
         return False
 
-    setup_logging(cliente)
+    setup_logging(cliente, por_proceso=log_por_proceso)
     
     logging.info("=" * 80)
     logging.info(f"INICIO PROCESAMIENTO: {os.path.basename(pdf_path)}")
@@ -331,43 +710,58 @@ def cortar_pdf(pdf_path, dpi=DEFAULT_DPI):
 
     total_pages = len(src_doc)
     total_splits = 0
+    bloques = []
 
-    # Procesar páginas
+    # Procesar páginas: las líneas se buscan primero entre los trazos vectoriales;
+    # si no hay, se rasteriza. El renderizado y el ensamblado se hacen en el hilo
+    # principal (PyMuPDF no admite acceso concurrente) y la detección sobre
+    # imagen, que no retiene el GIL, se reparte entre hilos
     logging.info("Procesando paginas...")
     
-    for pno in range(total_pages):
-        try:
-            logging.info(f"Pagina {pno + 1}/{total_pages}")
-            page = src_doc[pno]
-            
-            # Renderizar y detectar líneas
-            img, pix, zoom = render_page_to_image(page, dpi=dpi)
-            y_pixels = detect_horizontal_lines_refinado(img)
-            
-            if not y_pixels:
-                # Sin líneas detectadas, copiar página completa
-                logging.info("  - Sin lineas detectadas, copiando pagina completa")
-                out_doc.insert_pdf(src_doc, from_page=pno, to_page=pno)
-            else:
-                # Líneas detectadas, recortar
-                logging.info(f"  - {len(y_pixels)} linea(s) detectada(s)")
-                rects = pixel_lines_to_pdf_rects(y_pixels, pix.height, zoom)
-                
-                for idx, (y0, y1) in enumerate(rects, 1):
-                    rect = fitz.Rect(0, y0, page.rect.width, y1)
-                    new_page = out_doc.new_page(width=rect.width, height=rect.height)
-                    new_page.show_pdf_page(new_page.rect, src_doc, pno, clip=rect)
-                    logging.info(f"  - Recorte #{idx} creado")
+    max_workers = max(1, min(hilos or os.cpu_count() or 1, total_pages))
+    pendientes = deque()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for pno in range(total_pages):
+            try:
+                page = src_doc[pno]
+                zoom = dpi / 72.0
                 
-                total_splits += len(rects)
+                # Vía rápida: líneas vectoriales, sin rasterizar
+                ys_pdf = detect_horizontal_lines_vectorial(page)
                 
-        except Exception as e:
-            logging.warning(f"  - Error procesando pagina {pno + 1}: {e}")
-            continue
+                if ys_pdf:
+                    y_pixels = [y * zoom for y in ys_pdf]
+                    pendientes.append((pno, y_pixels, page.rect.height * zoom, zoom, None))
+                else:
+                    # Página escaneada o sin trazos válidos: detección sobre imagen.
+                    # Se guarda el pixmap: img_gray es una vista sobre su buffer
+                    img_gray, pix, zoom = render_page_to_image(page, dpi=dpi)
+                    params = build_detection_params(*img_gray.shape)
+                    futuro = executor.submit(detect_horizontal_lines_fast, img_gray, params)
+                    pendientes.append((pno, futuro, pix.height, zoom, pix))
+            except Exception as e:
+                logging.warning(f"  - Error procesando pagina {pno + 1}: {e}")
+            
+            # Ensamblar en orden, limitando las páginas renderizadas en memoria
+            ultima = pno == total_pages - 1
+            while pendientes and (ultima or len(pendientes) > 2 * max_workers):
+                pno_listo, lineas, img_height_px, zoom_listo, _pix = pendientes.popleft()
+                try:
+                    logging.info(f"Pagina {pno_listo + 1}/{total_pages}")
+                    if isinstance(lineas, Future):
+                        lineas = lineas.result()
+                    total_splits += recortar_pagina(
+                        src_doc, out_doc, pno_listo, lineas, img_height_px, zoom_listo
+                    )
+                    if out_doc.page_count >= PAGINAS_POR_BLOQUE:
+                        out_doc = volcar_bloque(out_doc, bloques)
+                except Exception as e:
+                    logging.warning(f"  - Error procesando pagina {pno_listo + 1}: {e}")
 
     # Guardar PDF resultante
     try:
-        out_doc.save(out_path)
+        guardar_pdf_salida(out_doc, bloques, out_path)
         logging.info(f"OK: PDF guardado exitosamente: {out_path}")
         logging.info(f"Resumen: {total_pages} pagina(s) -> {total_splits} recorte(s)")
         print(f"[OK] {cliente} procesado: {total_pages} pagina(s) -> {total_splits} recorte(s)")
@@ -379,6 +773,11 @@ def cortar_pdf(pdf_path, dpi=DEFAULT_DPI):
     finally:
         out_doc.close()
         src_doc.close()
+        for tmp_path in bloques:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
     # Mover archivo original
     destino_dir = procesados_dir if success else error_dir
@@ -408,10 +807,19 @@ def procesar_carpeta_batch(cliente):
     logging.info("=" * 80)
     
     in_dir = os.path.join(BASE_WORK_DIR, IN_DIR_NAME, cliente)
-    
-    # Buscar archivos
-    patron = os.path.join(in_dir, "*.pdf")
-    archivos_pdf = sorted(glob.glob(patron))
+    os.makedirs(in_dir, exist_ok=True)
+    
+    # Buscar archivos (DirEntry trae el tamaño del listado, sin stat extra)
+    archivos_pdf = []
+    with os.scandir(in_dir) as entries:
+        for entry in entries:
+            if not (entry.is_file() and entry.name.lower().endswith(".pdf")):
+                continue
+            if entry.stat().st_size == 0:
+                logging.warning(f"Archivo vacio, se omite: {entry.name}")
+                continue
+            archivos_pdf.append(entry.path)
+    archivos_pdf.sort()
     
     total_archivos = len(archivos_pdf)
     logging.info(f"Archivos encontrados: {total_archivos}")
@@ -424,18 +832,25 @@ def procesar_carpeta_batch(cliente):
     archivos_exitosos = 0
     archivos_fallidos = 0
 
-    # Procesar cada archivo
-    for idx, ruta in enumerate(archivos_pdf, 1):
-        nombre_archivo = os.path.basename(ruta)
-        logging.info(f"\n[{idx}/{total_archivos}] Procesando: {nombre_archivo}")
-        print(f"[{idx}/{total_archivos}] Procesando: {nombre_archivo}")
-        
-        exito = cortar_pdf(ruta)
+    # Procesar archivos en paralelo (cada proceso escribe en su propio log).
+    # El paralelismo ya está en los procesos: cada uno detecta con un solo
+    # hilo y sin hilos internos de OpenCV para no sobresuscribir la CPU
+    max_workers = min(os.cpu_count() or 1, total_archivos)
+    logging.info(f"Procesando con {max_workers} proceso(s)")
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        resultados = executor.map(partial(cortar_pdf, log_por_proceso=True, hilos=1), archivos_pdf)
         
-        if exito:
-            archivos_exitosos += 1
-        else:
-            archivos_fallidos += 1
+        for idx, (ruta, exito) in enumerate(zip(archivos_pdf, resultados), 1):
+            nombre_archivo = os.path.basename(ruta)
+            estado = "OK" if exito else "ERROR"
+            logging.info(f"[{idx}/{total_archivos}] {nombre_archivo}: {estado}")
+            print(f"[{idx}/{total_archivos}] {nombre_archivo}: {estado}")
+            
+            if exito:
+                archivos_exitosos += 1
+            else:
+                archivos_fallidos += 1
 
     # Resumen final
     logging.info("=" * 80)
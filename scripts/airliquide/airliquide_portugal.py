@@ -20,11 +20,18 @@ Fecha: Noviembre 2025
 
 import os
 import sys
-import glob
 import logging
 import shutil
 import re
+import csv
+import mmap
+import codecs
+import multiprocessing
+from collections import Counter
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import pandas as pd
@@ -47,6 +54,18 @@ LOG_DIR_NAME = "logs"
 
 CLIENTE = "AIRLIQUIDE_PORTUGAL"
 
+# Patrones de campos (compilados una sola vez)
+RE_FECHA = re.compile(r'^\d{2}\.\d{2}\.\d{4}$')
+RE_PT_PREFIX = re.compile(r'^PT\s+\d')
+RE_NUMERIC = re.compile(r'^[\d\.,]+$')
+RE_DIRECCION = re.compile(r'^(PT)\s+([\d\-]+)\s+(.+)$')
+
+# Textos que identifican las líneas de encabezado del listado
+MARCAS_CABECERA = ("Transportes", "Loc.exped")
+
+# Bytes iniciales usados para detectar el encoding
+MUESTRA_ENCODING = 64 * 1024
+
 # ================================================================================
 # CONFIGURACIÓN DE LOGGING
 # ================================================================================
@@ -54,16 +73,6 @@ CLIENTE = "AIRLIQUIDE_PORTUGAL"
 log_dir = os.path.join(BASE_WORK_DIR, LOG_DIR_NAME)
 os.makedirs(log_dir, exist_ok=True)
 
-timestamp_log = datetime.now().strftime("%Y%m%d_%H%M%S")
-log_file = os.path.join(log_dir, f"log_{timestamp_log}.txt")
-
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    force=True
-)
 logger = logging.getLogger("portugal_processor")
 
 # También log a consola
@@ -73,9 +82,42 @@ formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", "%Y-%m-
 console.setFormatter(formatter)
 logger.addHandler(console)
 
-logger.info("=" * 80)
-logger.info("SESIÓN INICIADA: Air Liquide Portugal")
-logger.info("=" * 80)
+# Los procesos del pool reimportan el módulo (spawn en Windows): la sesión y su
+# log solo se abren en el proceso principal; los workers reciben la ruta por initargs
+if multiprocessing.current_process().name == "MainProcess":
+    timestamp_log = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_file = os.path.join(log_dir, f"log_{timestamp_log}.txt")
+    
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        force=True
+    )
+    
+    logger.info("=" * 80)
+    logger.info("SESIÓN INICIADA: Air Liquide Portugal")
+    logger.info("=" * 80)
+
+
+def configurar_log_proceso(log_file_sesion):
+    """
+    Redirige el log de un proceso del pool a un archivo propio, nombrado
+    como el log de la sesión con sufijo PID, para no mezclar líneas de
+    procesos en paralelo.
+    
+    Args:
+        log_file_sesion: Ruta del log del proceso principal
+    """
+    log_file_proceso = f"{os.path.splitext(log_file_sesion)[0]}_{os.getpid()}.txt"
+    logging.basicConfig(
+        filename=log_file_proceso,
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        force=True
+    )
 
 # ================================================================================
 # VALIDACIÓN DE DEPENDENCIAS
@@ -85,60 +127,84 @@ try:
     import pandas as pd
 except ImportError:
     logger.error("DEPENDENCIA FALTANTE: pandas no está instalado")
-    print("[ERROR] pandas no instalado. Ejecuta: pip install pandas openpyxl")
+    print("[ERROR] pandas no instalado. Ejecuta: pip install pandas xlsxwriter")
+    sys.exit(1)
+
+try:
+    import xlsxwriter
+except ImportError:
+    logger.error("DEPENDENCIA FALTANTE: xlsxwriter no está instalado")
+    print("[ERROR] xlsxwriter no instalado. Ejecuta: pip install xlsxwriter")
     sys.exit(1)
 
 # ================================================================================
 # FUNCIONES AUXILIARES
 # ================================================================================
 
-def formatear_decimal(valor):
+def formatear_decimales(serie):
     """
-    Formatea un valor decimal para Excel.
+    Formatea una columna de valores decimales para Excel.
     
     Args:
-        valor: Cadena con el valor decimal
+        serie: Serie de pandas con los valores decimales
         
     Returns:
-        str: Valor formateado
+        Series: Valores formateados
     """
-    if not valor or not valor.strip():
-        return "0"
-    
-    valor = valor.strip()
+    serie = serie.fillna("").str.strip()
+    serie = serie.mask(serie == "", "0")
     
     # Si tiene punto y coma (formato europeo mixto), quitar puntos
-    if '.' in valor and ',' in valor:
-        valor = valor.replace(".", "")
-    
-    return valor
+    mixto = serie.str.contains(".", regex=False) & serie.str.contains(",", regex=False)
+    return serie.mask(mixto, serie.str.replace(".", "", regex=False))
 
 
-def convertir_fecha(fecha):
+def convertir_fechas(serie):
     """
-    Convierte formato de fecha de puntos a barras.
+    Convierte una columna de fechas de puntos a barras.
     
     Args:
-        fecha: Fecha en formato DD.MM.YYYY
+        serie: Serie de pandas con fechas en formato DD.MM.YYYY
         
     Returns:
-        str: Fecha en formato DD/MM/YYYY
+        Series: Fechas en formato DD/MM/YYYY
     """
-    if not fecha or not fecha.strip():
-        return ""
-    
-    fecha = fecha.strip()
+    serie = serie.fillna("").str.strip()
     
     # Formato DD.MM.YYYY
-    if re.match(r'^\d{2}\.\d{2}\.\d{4}$', fecha):
-        return fecha.replace(".", "/")
+    es_fecha = serie.str.match(RE_FECHA)
+    return serie.mask(es_fecha, serie.str.replace(".", "/", regex=False))
+
+
+def exportar_excel(df, ruta_xls, hoja="Pedidos"):
+    """
+    Escribe un DataFrame en un Excel fila a fila con xlsxwriter en modo
+    constant_memory (las filas se vuelcan a disco según se escriben).
+    
+    Nota: df.to_excel escribe por columnas, incompatible con constant_memory
+    (con pandas 2.1.3 / xlsxwriter 3.1.9 solo sobreviven la primera columna y
+    la última fila), por eso se escribe directamente con xlsxwriter.
     
-    return fecha
+    Args:
+        df: DataFrame a exportar
+        ruta_xls: Ruta del archivo Excel de salida
+        hoja: Nombre de la hoja
+    """
+    with xlsxwriter.Workbook(ruta_xls, {'constant_memory': True}) as workbook:
+        worksheet = workbook.add_worksheet(hoja)
+        
+        # Cabecera con el mismo estilo que usa pandas
+        formato_cabecera = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        worksheet.write_row(0, 0, df.columns, formato_cabecera)
+        
+        for fila, valores in enumerate(df.itertuples(index=False, name=None), 1):
+            worksheet.write_row(fila, 0, valores)
 
 
 def detectar_encoding(archivo_path):
     """
-    Detecta el encoding del archivo automáticamente.
+    Detecta el encoding del archivo a partir del BOM y de los primeros
+    MUESTRA_ENCODING bytes, con una sola lectura.
     
     Args:
         archivo_path: Ruta del archivo
@@ -146,20 +212,56 @@ def detectar_encoding(archivo_path):
     Returns:
         str: Encoding detectado
     """
-    encodings = ['utf-16', 'utf-16-le', 'utf-8', 'latin-1', 'cp1252']
-    
-    for enc in encodings:
+    with open(archivo_path, 'rb') as f:
+        head = f.read(MUESTRA_ENCODING)
+    
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    elif head.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif head[1::2].count(0) > len(head) // 4:
+        # UTF-16 LE sin BOM: texto ASCII con bytes nulos intercalados
+        encoding = 'utf-16-le'
+    elif head.isascii():
+        # ASCII puro: válido como UTF-8 sin necesidad de decodificar
+        encoding = 'utf-8'
+    else:
         try:
-            with open(archivo_path, 'r', encoding=enc) as f:
-                content = f.read(100)
-                if content.strip():
-                    logger.info(f"  └─ Encoding detectado: {enc}")
-                    return enc
-        except (UnicodeDecodeError, UnicodeError, Exception):
-            continue
+            # Decodificador incremental: tolera un carácter cortado al final
+            codecs.getincrementaldecoder('utf-8')().decode(head)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'cp1252'
+    
+    logger.info(f"  └─ Encoding detectado: {encoding}")
+    return encoding
+
+
+def leer_lineas(archivo_path, encoding):
+    """
+    Genera las líneas de un archivo TXT sin cargarlo entero en memoria.
+    Los archivos UTF-8 se leen con mmap decodificando línea a línea; el resto
+    de encodings (UTF-16, cp1252) se leen en streaming con buffer.
+    
+    Args:
+        archivo_path: Ruta del archivo
+        encoding: Encoding detectado
+        
+    Yields:
+        str: Cada línea, con su salto de línea
+    """
+    if encoding != 'utf-8':
+        with open(archivo_path, 'r', encoding=encoding, newline='', buffering=1 << 20) as f:
+            yield from f
+        return
     
-    logger.warning("No se pudo detectar encoding, usando UTF-16 por defecto")
-    return 'utf-16'
+    with open(archivo_path, 'rb') as f:
+        # mmap no admite archivos vacíos
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for linea in iter(mm.readline, b''):
+                yield linea.decode('utf-8')
 
 
 def validar_acceso_archivo(archivo_path):
@@ -181,8 +283,8 @@ def validar_acceso_archivo(archivo_path):
         return False
     
     try:
-        encoding = detectar_encoding(archivo_path)
-        with open(archivo_path, 'r', encoding=encoding) as f:
+        # Solo se comprueba la apertura; el encoding se detecta al procesar
+        with open(archivo_path, 'rb') as f:
             f.read(1)
         return True
     except Exception as e:
@@ -193,12 +295,161 @@ def validar_acceso_archivo(archivo_path):
 # FUNCIÓN PRINCIPAL DE PROCESAMIENTO
 # ================================================================================
 
-def procesar_archivo_txt(archivo_txt_path):
+def parsear_pedidos(lineas):
     """
-    Procesa un archivo TXT de pedidos y genera Excel.
+    Recorre las líneas de un TXT de pedidos y extrae los registros de detalle.
+    
+    Args:
+        lineas: Iterable de líneas de texto (ver leer_lineas)
+        
+    Returns:
+        tuple: (datos por columnas, líneas leídas, líneas procesadas)
+    """
+    # Variables de estado del archivo
+    apariciones_por_vehiculo = Counter()
+    descargas_por_viaje = {}
+    pedido_actual = None
+    vehiculo_actual = None
+    viaje_actual = 0
+    # Registros por columnas: el DataFrame se crea sin transponer filas
+    datos = {
+        "Nº PEDIDO": [],
+        "Nº PEDIDO DETALLE": [],
+        "FECHA": [],
+        "CLIENTE": [],
+        "CODIGO CLIENTE": [],
+        "DIRECCION": [],
+        "PESO": [],
+        "VOLUMEN": [],
+        "PAIS": [],
+        "CODIGO POSTAL": [],
+        "POBLACION": [],
+        "VEHICULO": [],
+        "VIAJE": [],
+        "DESCARGA": []
+    }
+    
+    lineas_leidas = 0
+    lineas_procesadas = 0
+    
+    # Separación por tabulador con el tokenizador en C del módulo csv
+    # (sin comillas: el TXT no las usa como delimitador de campo)
+    lector = csv.reader(lineas, delimiter='\t', quoting=csv.QUOTE_NONE)
+    
+    for fila in lector:
+        lineas_leidas += 1
+        
+        # Campos sin espacios ni vacíos
+        campos = list(filter(None, map(str.strip, fila)))
+        
+        # Saltar líneas vacías o de encabezado (solo se mira el primer campo:
+        # un cliente como "Transportes Silva Lda" es una línea de detalle)
+        if not campos or campos[0].startswith(MARCAS_CABECERA):
+            continue
+        
+        lineas_procesadas += 1
+        
+        # ===== DETECTAR PEDIDO (10 dígitos) =====
+        if len(campos[0]) == 10 and campos[0].isdigit():
+            
+            # Buscar vehículo en la línea
+            vehiculo = None
+            for campo in campos:
+                if campo.startswith("VH"):
+                    vehiculo = campo
+                    break
+            
+            if vehiculo:
+                # === CABECERA DE PEDIDO ===
+                pedido_actual = campos[0]
+                vehiculo_actual = vehiculo
+                
+                # Contar apariciones del vehículo
+                apariciones_por_vehiculo[vehiculo_actual] += 1
+                viaje_actual = apariciones_por_vehiculo[vehiculo_actual]
+                clave_viaje = f"{vehiculo_actual}-{viaje_actual}"
+                descargas_por_viaje[clave_viaje] = {}
+                
+                logger.info(f"  └─ PEDIDO: {pedido_actual} | {vehiculo_actual} | Viaje: {viaje_actual}")
+                continue
+            
+            else:
+                # === DETALLE DE PEDIDO ===
+                num_detalle = campos[0]
+                
+                # Clasificar campos en una sola pasada: números
+                # (volumen y peso), fecha DD.MM.YYYY (también es
+                # numérica) e índice de la dirección PT
+                fecha_encontrada = ""
+                idx_pt = -1
+                numeros = []
+                for i, campo in enumerate(campos):
+                    if RE_NUMERIC.match(campo):
+                        numeros.append(campo)
+                        if not fecha_encontrada and RE_FECHA.match(campo):
+                            fecha_encontrada = campo
+                    elif idx_pt < 0 and RE_PT_PREFIX.match(campo):
+                        idx_pt = i
+                
+                # Extraer datos del cliente
+                cod_cli = campos[idx_pt - 2] if idx_pt >= 2 else ""
+                cliente = campos[idx_pt - 1] if idx_pt >= 1 else ""
+                direccion = campos[idx_pt] if idx_pt >= 0 else ""
+                
+                # Calcular número de descarga
+                descargas_viaje = descargas_por_viaje[f"{vehiculo_actual}-{viaje_actual}"]
+                descarga_actual = descargas_viaje.setdefault(cod_cli, len(descargas_viaje) + 1)
+                
+                # Volumen y peso: últimos valores numéricos
+                volumen = "0"
+                peso = "0"
+                
+                if len(numeros) >= 2:
+                    volumen = numeros[-2]
+                    peso = numeros[-1]
+                elif len(numeros) == 1:
+                    peso = numeros[0]
+                
+                # Parsear dirección (PT 1234-567 CIUDAD)
+                pais = ""
+                cod_postal = ""
+                poblacion = ""
+                
+                match = RE_DIRECCION.match(direccion)
+                if match:
+                    pais = match.group(1)
+                    cod_postal = match.group(2)
+                    poblacion = match.group(3)
+                
+                # Crear registro
+                datos["Nº PEDIDO"].append(pedido_actual)
+                datos["Nº PEDIDO DETALLE"].append(num_detalle)
+                datos["FECHA"].append(fecha_encontrada)
+                datos["CLIENTE"].append(cliente)
+                datos["CODIGO CLIENTE"].append(cod_cli)
+                datos["DIRECCION"].append(direccion)
+                datos["PESO"].append(peso)
+                datos["VOLUMEN"].append(volumen)
+                datos["PAIS"].append(pais)
+                datos["CODIGO POSTAL"].append(cod_postal)
+                datos["POBLACION"].append(poblacion)
+                datos["VEHICULO"].append(vehiculo_actual)
+                datos["VIAJE"].append(viaje_actual)
+                datos["DESCARGA"].append(descarga_actual)
+    
+    return datos, lineas_leidas, lineas_procesadas
+
+
+def procesar_archivo_txt(archivo_txt_path, out_dir, procesados_dir, error_dir):
+    """
+    Procesa un archivo TXT de pedidos y genera Excel. Las carpetas de
+    destino deben existir (las crea quien llama, una sola vez).
     
     Args:
         archivo_txt_path: Ruta del archivo TXT a procesar
+        out_dir: Carpeta de salida de los Excel
+        procesados_dir: Carpeta destino del TXT si se procesa correctamente
+        error_dir: Carpeta destino del TXT si hay errores
         
     Returns:
         bool: True si el procesamiento fue exitoso
@@ -214,174 +465,57 @@ def procesar_archivo_txt(archivo_txt_path):
         logger.error("Procesamiento abortado: archivo no accesible")
         return False
     
-    # Variables de estado por archivo
-    apariciones_por_vehiculo = {}
-    descargas_por_viaje = {}
-    pedido_actual = None
-    vehiculo_actual = None
-    viaje_actual = 0
-    datos = []
-    
     try:
         # Detectar y leer archivo con encoding correcto
         encoding = detectar_encoding(archivo_txt_path)
         logger.info(f"Procesando con encoding: {encoding}")
         
-        with open(archivo_txt_path, 'r', encoding=encoding) as f:
-            lineas = f.readlines()
+        # Lectura en streaming: no se carga el archivo entero en memoria
+        # (closing libera el archivo antes de moverlo si hay un error)
+        try:
+            with closing(leer_lineas(archivo_txt_path, encoding)) as lineas:
+                datos, lineas_leidas, lineas_procesadas = parsear_pedidos(lineas)
+        except UnicodeDecodeError as e:
+            if encoding != 'utf-8':
+                raise
+            # El inicio del archivo era ASCII/UTF-8 pero más adelante hay
+            # bytes de otro encoding: se vuelve a leer entero como cp1252
+            logger.warning(f"Decodificación UTF-8 fallida ({e}); se reprocesa como cp1252")
+            encoding = 'cp1252'
+            with closing(leer_lineas(archivo_txt_path, encoding)) as lineas:
+                datos, lineas_leidas, lineas_procesadas = parsear_pedidos(lineas)
         
-        logger.info(f"Archivo cargado: {len(lineas)} líneas")
+        logger.info(f"Archivo cargado: {lineas_leidas} líneas")
         
         # Si no hay líneas, archivo está vacío
-        if len(lineas) == 0:
+        if lineas_leidas == 0:
             logger.warning("Archivo vacío después de leer")
-            error_dir = os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME)
-            os.makedirs(error_dir, exist_ok=True)
             shutil.move(archivo_txt_path, os.path.join(error_dir, nombre_archivo))
             logger.info("Archivo vacío movido a: ERRORES")
             return False
         
-        lineas_procesadas = 0
-        
-        for linea in lineas:
-            linea = linea.strip()
-            
-            # Saltar líneas vacías o de encabezado
-            if not linea or "Transportes" in linea or "Loc.exped" in linea:
-                continue
-            
-            lineas_procesadas += 1
-            
-            # Dividir campos por tabulador
-            campos = [c.strip() for c in linea.split('\t') if c.strip()]
-            
-            if not campos:
-                continue
-            
-            # ===== DETECTAR PEDIDO (10 dígitos) =====
-            if len(campos[0]) == 10 and campos[0].isdigit():
-                
-                # Buscar vehículo en la línea
-                vehiculo = None
-                for campo in campos:
-                    if campo.startswith("VH"):
-                        vehiculo = campo
-                        break
-                
-                if vehiculo:
-                    # === CABECERA DE PEDIDO ===
-                    pedido_actual = campos[0]
-                    vehiculo_actual = vehiculo
-                    
-                    # Contar apariciones del vehículo
-                    if vehiculo_actual not in apariciones_por_vehiculo:
-                        apariciones_por_vehiculo[vehiculo_actual] = 1
-                    else:
-                        apariciones_por_vehiculo[vehiculo_actual] += 1
-                    
-                    viaje_actual = apariciones_por_vehiculo[vehiculo_actual]
-                    clave_viaje = f"{vehiculo_actual}-{viaje_actual}"
-                    descargas_por_viaje[clave_viaje] = {}
-                    
-                    logger.info(f"  └─ PEDIDO: {pedido_actual} | {vehiculo_actual} | Viaje: {viaje_actual}")
-                    continue
-                
-                else:
-                    # === DETALLE DE PEDIDO ===
-                    num_detalle = campos[0]
-                    
-                    # Buscar fecha (formato DD.MM.YYYY)
-                    fecha_encontrada = ""
-                    for campo in campos:
-                        if re.match(r'^\d{2}\.\d{2}\.\d{4}$', campo):
-                            fecha_encontrada = campo
-                            break
-                    
-                    fecha = convertir_fecha(fecha_encontrada)
-                    
-                    # Buscar índice de dirección PT
-                    idx_pt = -1
-                    for i, campo in enumerate(campos):
-                        if re.match(r'^PT\s+\d', campo):
-                            idx_pt = i
-                            break
-                    
-                    # Extraer datos del cliente
-                    cod_cli = campos[idx_pt - 2] if idx_pt >= 2 else ""
-                    cliente = campos[idx_pt - 1] if idx_pt >= 1 else ""
-                    direccion = campos[idx_pt] if idx_pt >= 0 else ""
-                    
-                    # Calcular número de descarga
-                    clave_viaje = f"{vehiculo_actual}-{viaje_actual}"
-                    
-                    if cod_cli not in descargas_por_viaje[clave_viaje]:
-                        descargas_por_viaje[clave_viaje][cod_cli] = len(descargas_por_viaje[clave_viaje]) + 1
-                    
-                    descarga_actual = descargas_por_viaje[clave_viaje][cod_cli]
-                    
-                    # Extraer números (volumen y peso)
-                    numeros = [c for c in campos if re.match(r'^[\d\.,]+$', c)]
-                    
-                    volumen = "0"
-                    peso = "0"
-                    
-                    if len(numeros) >= 2:
-                        volumen = formatear_decimal(numeros[-2])
-                        peso = formatear_decimal(numeros[-1])
-                    elif len(numeros) == 1:
-                        peso = formatear_decimal(numeros[0])
-                    
-                    # Parsear dirección (PT 1234-567 CIUDAD)
-                    pais = ""
-                    cod_postal = ""
-                    poblacion = ""
-                    
-                    match = re.match(r'^(PT)\s+([\d\-]+)\s+(.+)$', direccion)
-                    if match:
-                        pais = match.group(1)
-                        cod_postal = match.group(2)
-                        poblacion = match.group(3)
-                    
-                    # Crear registro
-                    datos.append({
-                        "Nº PEDIDO": pedido_actual,
-                        "Nº PEDIDO DETALLE": num_detalle,
-                        "FECHA": fecha,
-                        "CLIENTE": cliente,
-                        "CODIGO CLIENTE": cod_cli,
-                        "DIRECCION": direccion,
-                        "PESO": peso,
-                        "VOLUMEN": volumen,
-                        "PAIS": pais,
-                        "CODIGO POSTAL": cod_postal,
-                        "POBLACION": poblacion,
-                        "VEHICULO": vehiculo_actual,
-                        "VIAJE": viaje_actual,
-                        "DESCARGA": descarga_actual
-                    })
-        
         logger.info(f"Líneas procesadas: {lineas_procesadas}")
-        logger.info(f"Registros generados: {len(datos)}")
+        total_registros = len(datos["Nº PEDIDO"])
+        logger.info(f"Registros generados: {total_registros}")
         
         # Generar Excel si hay datos
-        if len(datos) > 0:
+        if total_registros > 0:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             base_name = os.path.splitext(nombre_archivo)[0]
             nombre_xls = f"pedidos_{base_name}_{timestamp}.xlsx"
             
-            out_dir = os.path.join(BASE_WORK_DIR, OUT_DIR_NAME)
-            os.makedirs(out_dir, exist_ok=True)
             ruta_xls = os.path.join(out_dir, nombre_xls)
             
-            # Crear DataFrame y exportar
+            # Crear DataFrame, formatear columnas y exportar
             df = pd.DataFrame(datos)
-            df.to_excel(ruta_xls, sheet_name="Pedidos", index=False, engine='openpyxl')
+            df["FECHA"] = convertir_fechas(df["FECHA"])
+            df["PESO"] = formatear_decimales(df["PESO"])
+            df["VOLUMEN"] = formatear_decimales(df["VOLUMEN"])
+            exportar_excel(df, ruta_xls)
             
             logger.info(f"✓ Excel generado: {nombre_xls}")
             
             # Mover TXT a procesados
-            procesados_dir = os.path.join(BASE_WORK_DIR, PROCESADOS_DIR_NAME)
-            os.makedirs(procesados_dir, exist_ok=True)
             shutil.move(archivo_txt_path, os.path.join(procesados_dir, nombre_archivo))
             logger.info("Archivo movido a: PROCESADOS")
             
@@ -391,8 +525,6 @@ def procesar_archivo_txt(archivo_txt_path):
             logger.warning("Sin datos para generar Excel")
             
             # Mover a errores
-            error_dir = os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME)
-            os.makedirs(error_dir, exist_ok=True)
             shutil.move(archivo_txt_path, os.path.join(error_dir, nombre_archivo))
             logger.info("Archivo movido a: ERRORES")
             
@@ -403,8 +535,6 @@ def procesar_archivo_txt(archivo_txt_path):
         
         # Mover a errores
         try:
-            error_dir = os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME)
-            os.makedirs(error_dir, exist_ok=True)
             shutil.move(archivo_txt_path, os.path.join(error_dir, nombre_archivo))
             logger.info("Archivo movido a: ERRORES")
         except Exception as move_error:
@@ -425,13 +555,20 @@ def procesar_carpeta_batch():
     logger.info("=" * 80)
     
     in_dir = os.path.join(BASE_WORK_DIR, IN_DIR_NAME)
+    out_dir = os.path.join(BASE_WORK_DIR, OUT_DIR_NAME)
+    procesados_dir = os.path.join(BASE_WORK_DIR, PROCESADOS_DIR_NAME)
+    error_dir = os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME)
     
-    # Crear directorio de entrada si no existe
-    os.makedirs(in_dir, exist_ok=True)
+    # Crear directorios una sola vez para todo el lote
+    for carpeta in (in_dir, out_dir, procesados_dir, error_dir):
+        os.makedirs(carpeta, exist_ok=True)
     
-    # Buscar archivos TXT ordenados por fecha de modificación
-    patron = os.path.join(in_dir, "*.txt")
-    archivos_txt = sorted(glob.glob(patron), key=os.path.getmtime)
+    # Buscar archivos TXT ordenados por fecha de modificación (DirEntry
+    # cachea el stat, sin una llamada extra por archivo)
+    with os.scandir(in_dir) as entries:
+        archivos = [e for e in entries if e.is_file(follow_symlinks=False) and e.name.lower().endswith(".txt")]
+    archivos.sort(key=lambda e: e.stat().st_mtime)
+    archivos_txt = [e.path for e in archivos]
     
     total_archivos = len(archivos_txt)
     logger.info(f"Archivos encontrados: {total_archivos}")
@@ -444,18 +581,35 @@ def procesar_carpeta_batch():
     archivos_exitosos = 0
     archivos_fallidos = 0
     
-    # Procesar cada archivo secuencialmente
-    for idx, ruta in enumerate(archivos_txt, 1):
-        nombre_archivo = os.path.basename(ruta)
-        logger.info(f"\n[{idx}/{total_archivos}] Procesando: {nombre_archivo}")
-        print(f"[{idx}/{total_archivos}] Procesando: {nombre_archivo}")
-        
-        exito = procesar_archivo_txt(ruta)
-        
-        if exito:
-            archivos_exitosos += 1
-        else:
-            archivos_fallidos += 1
+    # Procesar archivos en paralelo (cada proceso escribe en su propio log)
+    max_workers = min(os.cpu_count() or 1, total_archivos)
+    logger.info(f"Procesando con {max_workers} proceso(s)")
+    
+    worker = partial(procesar_archivo_txt, out_dir=out_dir, procesados_dir=procesados_dir, error_dir=error_dir)
+    
+    # Con un solo proceso no compensa arrancar el pool: en Windows (spawn)
+    # cada proceso reimporta el módulo y pandas antes de procesar nada
+    if max_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=configurar_log_proceso, initargs=(log_file,))
+        resultados = executor.map(worker, archivos_txt)
+    else:
+        executor = None
+        resultados = map(worker, archivos_txt)
+    
+    try:
+        for idx, (ruta, exito) in enumerate(zip(archivos_txt, resultados), 1):
+            nombre_archivo = os.path.basename(ruta)
+            estado = "OK" if exito else "ERROR"
+            logger.info(f"[{idx}/{total_archivos}] {nombre_archivo}: {estado}")
+            print(f"[{idx}/{total_archivos}] {nombre_archivo}: {estado}")
+            
+            if exito:
+                archivos_exitosos += 1
+            else:
+                archivos_fallidos += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
     
     # Resumen final
     logger.info("=" * 80)
@@ -497,7 +651,13 @@ def procesar_archivo_api(folder_name, filename, metadata):
         print(f"[ERROR] Archivo no encontrado: {ruta}")
         sys.exit(1)
     
-    exito = procesar_archivo_txt(ruta)
+    # Carpetas creadas por inicializar_estructura()
+    exito = procesar_archivo_txt(
+        ruta,
+        os.path.join(BASE_WORK_DIR, OUT_DIR_NAME),
+        os.path.join(BASE_WORK_DIR, PROCESADOS_DIR_NAME),
+        os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME)
+    )
     sys.exit(0 if exito else 1)
 
 # ================================================================================
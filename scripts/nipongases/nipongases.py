@@ -20,14 +20,13 @@ Fecha: Noviembre 2025
 
 import os
 import sys
-import io
-import glob
 import logging
 import shutil
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import fitz
-from PIL import Image
 import numpy as np
 import cv2
 
@@ -49,8 +48,9 @@ DEFAULT_DPI = 200
 DEFAULT_SCALE = 2.0
 MARGEN_SUPERIOR_BARCODE = 300
 MARGEN_INFERIOR_BARCODE = 300
-REINTENTOS_ARCHIVO = 3
-ESPERA_ARCHIVO = 2
+REINTENTOS_ARCHIVO = 6
+ESPERA_INICIAL_ARCHIVO = 0.2  # Segundos; se duplica en cada reintento
+ESPERA_ARCHIVO = 1            # Espera máxima entre reintentos
 
 # ================================================================================
 # CONFIGURACIÓN DE LOGGING
@@ -68,6 +68,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger("nipongases_processor")
 
+
+def configurar_log_proceso(log_file_sesion):
+    """
+    Redirige el log de un proceso del pool a un archivo propio, nombrado
+    como el log del proceso principal con sufijo PID, para no mezclar
+    líneas de procesos en paralelo.
+    
+    Args:
+        log_file_sesion: Ruta del log del proceso principal
+    """
+    log_file_proceso = f"{os.path.splitext(log_file_sesion)[0]}_{os.getpid()}.log"
+    logging.basicConfig(
+        filename=log_file_proceso,
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        force=True
+    )
+
 # ================================================================================
 # VALIDACIÓN DE DEPENDENCIAS
 # ================================================================================
@@ -85,31 +103,40 @@ except ImportError:
 
 def esperar_archivo(pdf_path, reintentos=REINTENTOS_ARCHIVO, espera=ESPERA_ARCHIVO):
     """
-    Espera a que un archivo esté disponible y accesible.
+    Espera a que un archivo esté disponible y su tamaño sea estable (copia
+    terminada). Comprueba con os.stat y espera con backoff exponencial.
     
     Args:
         pdf_path: Ruta del archivo PDF
         reintentos: Número de intentos de acceso
-        espera: Segundos entre intentos
+        espera: Segundos máximos entre intentos
         
     Returns:
         bool: True si el archivo es accesible, False en caso contrario
     """
     logger.info(f"Verificando acceso al archivo: {os.path.basename(pdf_path)}")
     
+    tamano_anterior = -1
+    
     for intento in range(1, reintentos + 1):
-        if os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 0:
-            try:
-                with open(pdf_path, "rb") as f:
-                    logger.info(f"✓ Archivo accesible (intento {intento}/{reintentos})")
-                    return True
-            except (PermissionError, OSError) as e:
-                logger.warning(f"Intento {intento}/{reintentos}: Archivo bloqueado - {e}")
-        else:
+        try:
+            tamano = os.stat(pdf_path).st_size
+        except OSError:
+            tamano = 0
+        
+        if tamano > 0 and tamano == tamano_anterior:
+            logger.info(f"✓ Archivo accesible (intento {intento}/{reintentos})")
+            return True
+        
+        if tamano == 0:
             logger.warning(f"Intento {intento}/{reintentos}: Archivo no existe o está vacío")
+        elif tamano_anterior > 0:
+            logger.warning(f"Intento {intento}/{reintentos}: Archivo en copia ({tamano} bytes)")
+        
+        tamano_anterior = tamano
         
         if intento < reintentos:
-            time.sleep(espera)
+            time.sleep(min(ESPERA_INICIAL_ARCHIVO * 2 ** (intento - 1), espera))
     
     logger.error(f"✗ Archivo no accesible tras {reintentos} intentos")
     return False
@@ -120,15 +147,13 @@ def preprocess_for_barcode(pix, scale=DEFAULT_SCALE):
     Preprocesa una imagen para mejorar la detección de códigos de barras.
     
     Args:
-        pix: Pixmap de PyMuPDF
+        pix: Pixmap de PyMuPDF en escala de grises
         scale: Factor de escalado para mejorar resolución
         
     Returns:
         tuple: (imagen procesada, dimensiones)
     """
-    img_pil = Image.open(io.BytesIO(pix.tobytes("png")))
-    arr = np.array(img_pil.convert("RGB"))[:, :, :3]
-    gray = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
     h, w = gray.shape
     
     # Escalar imagen
@@ -160,7 +185,7 @@ def detect_barcodes_on_page(page, dpi=DEFAULT_DPI, scale=DEFAULT_SCALE):
     Returns:
         tuple: (lista de códigos, zoom, scale, dimensiones)
     """
-    pix = page.get_pixmap(dpi=dpi)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
     zoom = dpi / 72.0
     cv_img, (img_w, img_h) = preprocess_for_barcode(pix, scale=scale)
     
@@ -223,12 +248,13 @@ def create_clipped_page_from_rect(src_doc, out_doc, pno, rect_pdf):
 # FUNCIÓN PRINCIPAL DE PROCESAMIENTO
 # ================================================================================
 
-def cortar_pdf_nipongases(pdf_path):
+def cortar_pdf_nipongases(pdf_path, out_dir):
     """
     Procesa un PDF de Nipongases recortando por códigos de barras.
     
     Args:
         pdf_path: Ruta del archivo PDF a procesar
+        out_dir: Carpeta de salida (debe existir)
         
     Returns:
         bool: True si el procesamiento fue exitoso, False en caso contrario
@@ -237,11 +263,6 @@ def cortar_pdf_nipongases(pdf_path):
     logger.info(f"INICIO PROCESAMIENTO: {os.path.basename(pdf_path)}")
     logger.info("=" * 80)
     
-    # Validar acceso al archivo
-    if not esperar_archivo(pdf_path):
-        logger.error(f"Procesamiento abortado: archivo no accesible")
-        return False
-
     # Abrir documento
     try:
         src = fitz.open(pdf_path)
@@ -252,6 +273,7 @@ def cortar_pdf_nipongases(pdf_path):
 
     out = fitz.open()
     used_barcodes = set()
+    recortes_creados = set()
     total_recortes = 0
 
     # Procesar páginas
@@ -268,6 +290,7 @@ def cortar_pdf_nipongases(pdf_path):
                 continue
             
             logger.info(f"  └─ {len(barcodes)} código(s) encontrado(s)")
+            
             barcodes_sorted = sorted(barcodes, key=lambda b: b["y_center"])
             
             for bc in barcodes_sorted:
@@ -289,6 +312,14 @@ def cortar_pdf_nipongases(pdf_path):
                     image_coord_to_pdf(y_bottom_img, zoom, scale_used)
                 )
                 
+                # Evitar recortes idénticos (códigos distintos a la misma altura)
+                clave_recorte = (pno, round(rect_pdf.y0, 1), round(rect_pdf.y1, 1))
+                if clave_recorte in recortes_creados:
+                    logger.info(f"  └─ Recorte idéntico ya creado, omitiendo código '{bc['data']}'")
+                    continue
+                
+                recortes_creados.add(clave_recorte)
+                
                 # Crear página recortada
                 if create_clipped_page_from_rect(src, out, pno, rect_pdf):
                     total_recortes += 1
@@ -311,9 +342,8 @@ def cortar_pdf_nipongases(pdf_path):
     logger.info(f"Total de recortes generados: {total_recortes}")
 
     # Guardar PDF final
-    os.makedirs(OUT_DIR, exist_ok=True)
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    out_path = os.path.join(OUT_DIR, f"{base_name}_recortado.pdf")
+    out_path = os.path.join(out_dir, f"{base_name}_recortado.pdf")
     
     try:
         out.save(out_path)
@@ -325,6 +355,38 @@ def cortar_pdf_nipongases(pdf_path):
     finally:
         out.close()
 
+
+def procesar_y_mover(ruta, out_dir, procesados_dir, revisar_dir):
+    """
+    Procesa un PDF y lo mueve a PROCESADOS o ERRORES según el resultado.
+    Si el archivo sigue en copia se deja en entrada para la siguiente pasada.
+    
+    Args:
+        ruta: Ruta del archivo PDF
+        out_dir: Carpeta de salida del PDF recortado
+        procesados_dir: Carpeta destino si el procesamiento es correcto
+        revisar_dir: Carpeta destino si el procesamiento falla
+        
+    Returns:
+        bool: True si el procesamiento fue exitoso, False en caso contrario
+    """
+    # Archivo bloqueado o aún en copia: se deja en entrada para la siguiente pasada
+    if not esperar_archivo(ruta):
+        logger.error(f"Procesamiento abortado: archivo no accesible, se deja en entrada")
+        return False
+    
+    exito = cortar_pdf_nipongases(ruta, out_dir)
+    
+    # Mover archivo según resultado
+    destino = procesados_dir if exito else revisar_dir
+    try:
+        shutil.move(ruta, os.path.join(destino, os.path.basename(ruta)))
+        logger.info(f"Archivo movido a: {'PROCESADOS' if exito else 'ERRORES'}")
+    except Exception as e:
+        logger.warning(f"No se pudo mover archivo: {e}")
+    
+    return exito
+
 # ================================================================================
 # MODO BATCH (PROCESAR CARPETA COMPLETA)
 # ================================================================================
@@ -341,13 +403,13 @@ def procesar_carpeta_batch():
     procesados_dir = os.path.join(BASE_WORK_DIR, PROCESADOS_DIR_NAME, CLIENTE)
     revisar_dir = os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME, CLIENTE)
     
-    # Crear directorios
-    os.makedirs(procesados_dir, exist_ok=True)
-    os.makedirs(revisar_dir, exist_ok=True)
+    # Crear directorios una sola vez para todo el lote
+    for carpeta in (in_dir, OUT_DIR, procesados_dir, revisar_dir):
+        os.makedirs(carpeta, exist_ok=True)
 
-    # Buscar archivos
-    patron = os.path.join(in_dir, "*.pdf")
-    archivos_pdf = sorted(glob.glob(patron))
+    # Buscar archivos (un solo listado del directorio con scandir)
+    with os.scandir(in_dir) as entries:
+        archivos_pdf = sorted(e.path for e in entries if e.is_file(follow_symlinks=False) and e.name.lower().endswith(".pdf"))
     
     total_archivos = len(archivos_pdf)
     logger.info(f"Archivos encontrados: {total_archivos}")
@@ -360,28 +422,25 @@ def procesar_carpeta_batch():
     archivos_exitosos = 0
     archivos_fallidos = 0
 
-    # Procesar cada archivo
-    for idx, ruta in enumerate(archivos_pdf, 1):
-        nombre_archivo = os.path.basename(ruta)
-        logger.info(f"\n[{idx}/{total_archivos}] Procesando: {nombre_archivo}")
-        
-        exito = cortar_pdf_nipongases(ruta)
-        
-        # Mover archivo según resultado
-        if exito:
-            archivos_exitosos += 1
-            destino = os.path.join(procesados_dir, nombre_archivo)
-            carpeta_destino = "PROCESADOS"
-        else:
-            archivos_fallidos += 1
-            destino = os.path.join(revisar_dir, nombre_archivo)
-            carpeta_destino = "ERRORES"
+    # Procesar archivos en paralelo (cada proceso escribe en su propio log)
+    max_workers = min(os.cpu_count() or 1, total_archivos)
+    logger.info(f"Procesando con {max_workers} proceso(s)")
+    
+    worker = partial(procesar_y_mover, out_dir=OUT_DIR, procesados_dir=procesados_dir, revisar_dir=revisar_dir)
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=configurar_log_proceso, initargs=(log_file,)) as executor:
+        resultados = executor.map(worker, archivos_pdf)
         
-        try:
-            shutil.move(ruta, destino)
-            logger.info(f"Archivo movido a: {carpeta_destino}")
-        except Exception as e:
-            logger.warning(f"No se pudo mover archivo: {e}")
+        for idx, (ruta, exito) in enumerate(zip(archivos_pdf, resultados), 1):
+            nombre_archivo = os.path.basename(ruta)
+            estado = "OK" if exito else "ERROR"
+            logger.info(f"[{idx}/{total_archivos}] {nombre_archivo}: {estado}")
+            print(f"[{idx}/{total_archivos}] {nombre_archivo}: {estado}")
+            
+            if exito:
+                archivos_exitosos += 1
+            else:
+                archivos_fallidos += 1
 
     # Resumen final
     logger.info("=" * 80)
@@ -419,8 +478,8 @@ def procesar_archivo_api(folder, filename, metadata):
     procesados_dir = os.path.join(BASE_WORK_DIR, PROCESADOS_DIR_NAME, CLIENTE)
     revisar_dir = os.path.join(BASE_WORK_DIR, ERROR_DIR_NAME, CLIENTE)
     
-    os.makedirs(procesados_dir, exist_ok=True)
-    os.makedirs(revisar_dir, exist_ok=True)
+    for carpeta in (in_dir, OUT_DIR, procesados_dir, revisar_dir):
+        os.makedirs(carpeta, exist_ok=True)
     
     ruta = os.path.join(in_dir, filename)
     
@@ -429,16 +488,7 @@ def procesar_archivo_api(folder, filename, metadata):
         print(f"[ERROR] Archivo no encontrado: {ruta}")
         sys.exit(1)
     
-    exito = cortar_pdf_nipongases(ruta)
-    
-    # Mover archivo según resultado
-    destino = procesados_dir if exito else revisar_dir
-    try:
-        shutil.move(ruta, os.path.join(destino, filename))
-        logger.info(f"Archivo movido a: {'PROCESADOS' if exito else 'ERRORES'}")
-    except Exception as e:
-        logger.warning(f"No se pudo mover archivo: {e}")
-    
+    exito = procesar_y_mover(ruta, OUT_DIR, procesados_dir, revisar_dir)
     sys.exit(0 if exito else 1)
 
 # ================================================================================